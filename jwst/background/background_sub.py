@@ -1,12 +1,13 @@
-import copy
+import concurrent.futures
+import functools
+import os
+
 import numpy as np
 import warnings
 
 from stdatamodels.jwst import datamodels
 
 from . import subtract_images
-from astropy.stats import sigma_clip
-from astropy.utils.exceptions import AstropyUserWarning
 
 import logging
 
@@ -53,8 +54,15 @@ class ImageSubsetArray:
         self.imin = im.meta.subarray.xstart - 1
         self.imax = im.meta.subarray.xsize + self.imin
 
-        # Check the dimensionality of this thing
+        # The same bounds as one int vector (imin, jmin, imax, jmax), so
+        # overlap tests and intersections are single vectorized compares
+        self.bbox = np.array([self.imin, self.jmin, self.imax, self.jmax],
+                             dtype=np.int32)
+
+        # Check the dimensionality of this thing, and bind the matching
+        # cutout index builder once rather than re-deciding per cutout
         self.im_dim = len(im.data.shape)
+        self._make_index = self._index_2d if self.im_dim == 2 else self._index_3d
 
         self.data = im.data
         self.err = im.err
@@ -62,25 +70,32 @@ class ImageSubsetArray:
 
         im.close()
 
+    @staticmethod
+    def _index_2d(jlo, jhi, ilo, ihi):
+        return (slice(jlo, jhi), slice(ilo, ihi))
+
+    @staticmethod
+    def _index_3d(jlo, jhi, ilo, ihi):
+        return (slice(None), slice(jlo, jhi), slice(ilo, ihi))
+
     def overlaps(self, other):
         """Find whether this subset and another overlap"""
-        return not (
-                self.imax <= other.imin
-                or other.imax <= self.imin
-                or self.jmax <= other.jmin
-                or other.jmax <= self.jmin
-        )
+        lower = np.maximum(self.bbox[:2], other.bbox[:2])
+        upper = np.minimum(self.bbox[2:], other.bbox[2:])
+        return bool((upper > lower).all())
 
     def get_subset_array(self, other):
         """
         Pull out the overlapping part of two arrays, and put data/err/DQ
-        to match the science image pixels
+        to match the science image pixels.
+
+        For 3D data the returned arrays are laid out as (ny, nx, nints),
+        i.e. with the integration axis last, so that the per-pixel
+        reductions done by the caller run along the contiguous axis.
         """
 
-        imin = max(self.imin, other.imin)
-        imax = min(self.imax, other.imax)
-        jmin = max(self.jmin, other.jmin)
-        jmax = min(self.jmax, other.jmax)
+        imin, jmin = np.maximum(self.bbox[:2], other.bbox[:2])
+        imax, jmax = np.minimum(self.bbox[2:], other.bbox[2:])
 
         if imax < imin:
             imax = imin
@@ -88,42 +103,165 @@ class ImageSubsetArray:
         if jmax < jmin:
             jmax = jmin
 
+        # Fast path: both arrays cover exactly the same footprint, so the
+        # cutout is the whole background array and no NaN padding is
+        # needed. Return copies, since callers may modify these in place.
+        if (self.im_dim == other.im_dim
+                and (imin, imax, jmin, jmax) == (self.imin, self.imax, self.jmin, self.jmax)
+                and (imin, imax, jmin, jmax) == (other.imin, other.imax, other.jmin, other.jmax)
+                and self.data.shape[-2:] == other.data.shape[-2:]):
+            if self.im_dim == 2:
+                return other.data.copy(), other.err.copy(), other.dq.copy()
+            return (np.ascontiguousarray(other.data.transpose(1, 2, 0)),
+                    np.ascontiguousarray(other.err.transpose(1, 2, 0)),
+                    np.ascontiguousarray(other.dq.transpose(1, 2, 0)))
+
         # To ensure that we can mix and match subarray obs, take
         # the x/y shape from self.data. To ensure we can work
         # with mismatched NINTS, if we have that third dimension
-        # use the value from other
-        data_shape = list(self.data.shape)
-        if self.im_dim == 3:
-            data_shape[0] = other.data.shape[0]
-
-        # Set up arrays, NaN out data/err for sigma clipping, keep DQ as 0 for bitwise_or
-        data_overlap = np.full(data_shape, np.nan, dtype=other.data.dtype)
-        err_overlap = np.full(data_shape, np.nan, dtype=other.data.dtype)
-        dq_overlap = np.zeros(data_shape, dtype=np.uint32)
-
+        # use the value from other; keep the integration axis last
+        # for cache-friendly reductions along it
         if self.im_dim == 2:
-            idx = (slice(jmin - other.jmin, jmax - other.jmin),
-                   slice(imin - other.imin, imax - other.imin),
-                   )
+            data_shape = list(self.data.shape)
         else:
-            idx = (slice(None, None),
-                   slice(jmin - other.jmin, jmax - other.jmin),
-                   slice(imin - other.imin, imax - other.imin),
-                   )
+            data_shape = [self.data.shape[-2], self.data.shape[-1],
+                          other.data.shape[0]]
+
+        # Set up arrays; only the margins not covered by the cutout get
+        # NaNed out for sigma clipping (below), keep DQ as 0 for bitwise_or
+        data_overlap = np.empty(data_shape, dtype=other.data.dtype)
+        err_overlap = np.empty(data_shape, dtype=other.data.dtype)
+        dq_overlap = np.zeros(data_shape, dtype=np.uint32)
+
+        idx = self._make_index(jmin - other.jmin, jmax - other.jmin,
+                               imin - other.imin, imax - other.imin)
 
         # Pull the values from the background obs
         data_cutout = other.data[idx]
         err_cutout = other.err[idx]
         dq_cutout = other.dq[idx]
 
-        # Put them into the right place in the original image array shape
-        data_overlap[..., :data_cutout.shape[-2], :data_cutout.shape[-1]] = copy.deepcopy(data_cutout)
-        err_overlap[..., :data_cutout.shape[-2], :data_cutout.shape[-1]] = copy.deepcopy(err_cutout)
-        dq_overlap[..., :data_cutout.shape[-2], :data_cutout.shape[-1]] = copy.deepcopy(dq_cutout)
+        # Put them into the right place in the original image array shape,
+        # then NaN out the data/err margins the cutout does not cover
+        ny, nx = data_cutout.shape[-2:]
+        if self.im_dim == 2:
+            data_overlap[:ny, :nx] = data_cutout
+            err_overlap[:ny, :nx] = err_cutout
+            dq_overlap[:ny, :nx] = dq_cutout
+            data_overlap[ny:, :] = np.nan
+            err_overlap[ny:, :] = np.nan
+            data_overlap[:ny, nx:] = np.nan
+            err_overlap[:ny, nx:] = np.nan
+        else:
+            data_overlap[:ny, :nx, :] = data_cutout.transpose(1, 2, 0)
+            err_overlap[:ny, :nx, :] = err_cutout.transpose(1, 2, 0)
+            dq_overlap[:ny, :nx, :] = dq_cutout.transpose(1, 2, 0)
+            data_overlap[ny:, :, :] = np.nan
+            err_overlap[ny:, :, :] = np.nan
+            data_overlap[:ny, nx:, :] = np.nan
+            err_overlap[:ny, nx:, :] = np.nan
 
         return data_overlap, err_overlap, dq_overlap
 
 
+@functools.lru_cache(maxsize=8)
+def _cached_subset_array(filename, mtime, size):
+    # mtime and size are part of the cache key so that a file rewritten
+    # at the same path is reread instead of served stale from the cache
+    return ImageSubsetArray(filename)
+
+
+def _open_subset_array(background):
+    """
+    Open a background exposure as an ImageSubsetArray.
+
+    Exposures given by filename are cached, so that associations reusing
+    the same background files across many targets only read each file
+    once. The cache is keyed on the resolved path plus the file's
+    modification time and size, so a file rewritten in place is not
+    served stale. The cached arrays are shared; callers must not modify
+    them (get_subset_array already hands out copies). Up to 8 exposures
+    are retained for the life of the process; call
+    ``_cached_subset_array.cache_clear()`` to release them.
+    """
+    if isinstance(background, (str, os.PathLike)):
+        filename = os.path.realpath(background)
+        stat = os.stat(filename)
+        return _cached_subset_array(filename, stat.st_mtime_ns, stat.st_size)
+    return ImageSubsetArray(background)
+
+
+def _sigma_clip_nan(data, sigma, maxiters, axis=0):
+    """
+    Iteratively sigma-clip an array about its median along an axis,
+    replacing clipped values with NaN in place.
+
+    Clipping stops as soon as an iteration rejects no new values, so
+    well-behaved backgrounds converge in a couple of passes regardless
+    of `maxiters`. Callers must pass a float array they own.
+
+    Parameters
+    ----------
+    data : ndarray
+        Array to be clipped; modified in place.
+
+    sigma : float
+        Number of standard deviations to use for both the lower
+        and upper clipping limits.
+
+    maxiters : int or None
+        Maximum number of sigma-clipping iterations to perform,
+        or None to iterate until convergence.
+
+    axis : int
+        Axis along which to clip.
+
+    Returns
+    -------
+    ndarray
+        The input array, with clipped values set to NaN.
+    """
+
+    if maxiters is None:
+        maxiters = np.inf
+
+    # NaN comparisons and all-NaN slices raise RuntimeWarnings here; the
+    # caller is expected to filter them. The filtering cannot live in this
+    # function because warning filters are process-global state, which must
+    # not be toggled from the worker threads this runs in.
+
+    # Non-finite values can never survive the clip, so drop them up
+    # front to keep the median/std finite
+    data[~np.isfinite(data)] = np.nan
+
+    niter = 0
+    while niter < maxiters:
+        center = np.nanmedian(data, axis=axis, keepdims=True)
+        stddev = np.nanstd(data, axis=axis, keepdims=True)
+        clipped = np.abs(data - center) > sigma * stddev
+        if not clipped.any():
+            break
+        data[clipped] = np.nan
+        niter += 1
+
+    return data
+
+
+def _clipped_mean(data, sigma, maxiters, axis=0):
+    """
+    Sigma-clip an array along an axis and return the mean of the
+    surviving values; NaN where no values survive.
+
+    This fuses the clip and the subsequent average into one routine.
+    Clipped values are replaced by NaN in place, so callers must pass a
+    float array they own.
+    """
+
+    data = _sigma_clip_nan(data, sigma, maxiters, axis=axis)
+
+    return np.nanmean(data, axis=axis)
+
+
 def background_sub(input_model, bkg_list, sigma, maxiters):
     """
     Short Summary
@@ -208,62 +346,79 @@ def average_background(input_model, bkg_list, sigma, maxiters):
 
     avg_bkg = datamodels.ImageModel(image_shape)
     num_bkg = len(bkg_list)
-    cdata = np.zeros(((num_bkg,) + image_shape))
-    cerr = cdata.copy()
-
-    if bkg_dim == 3:
-        accum_dq_arr = np.zeros((image_shape), dtype=np.uint32)
-
-    # Loop over the images to be used as background
-    for i, bkg_file in enumerate(bkg_list):
+    # Accumulation slabs; match the science dtype (float32 for JWST rate
+    # data) so planes are never upcast on assignment. Every plane is
+    # filled in the loop below.
+    cdata = np.empty(((num_bkg,) + image_shape), dtype=input_model.data.dtype)
+    cerr = np.empty_like(cdata)
+
+    def accumulate_background(i, bkg_file):
+        """Load one background exposure into plane i of the slabs."""
         log.info(f'Accumulate bkg from {bkg_file}')
 
-        bkg_array = ImageSubsetArray(bkg_file)
+        bkg_array = _open_subset_array(bkg_file)
 
         if not bkg_array.overlaps(im_array):
             # We don't overlap, so put in a bunch of NaNs so sigma-clip
             # isn't affected and move on
             log.debug(f'{bkg_file} does not overlap input image')
-            cdata[i] = np.ones(image_shape) * np.nan
-            cerr[i] = np.ones(image_shape) * np.nan
-            continue
+            cdata[i].fill(np.nan)
+            cerr[i].fill(np.nan)
+            return None
 
         bkg_data, bkg_err, bkg_dq = im_array.get_subset_array(bkg_array)
 
         if bkg_dim == 2:
-            # Accumulate the data from this background image
+            # Accumulate the data from this background image; square the
+            # err directly into the slab to avoid a full-size temporary
             cdata[i] = bkg_data  # 2D slice
-            cerr[i] = bkg_err * bkg_err
-            avg_bkg.dq = np.bitwise_or(avg_bkg.dq, bkg_dq)
-
-        if bkg_dim == 3:
-            # Sigma clip the bkg model's data and err along the integration axis
-            with warnings.catch_warnings():
-                # clipping NaNs and infs is the expected behavior
-                warnings.filterwarnings("ignore", category=AstropyUserWarning, message=".*automatically clipped.*")
-                sc_bkg_data = sigma_clip(bkg_data, sigma=sigma, maxiters=maxiters, axis=0)
-                sc_bkg_err = sigma_clip(bkg_err * bkg_err, sigma=sigma, maxiters=maxiters, axis=0)
-
-            # Accumulate the integ-averaged clipped data and err for the file
-            cdata[i] = sc_bkg_data.mean(axis=0)
-            cerr[i] = sc_bkg_err.mean(axis=0)
-
-            # Collapse the DQ by doing a bitwise_OR over all integrations
-            for i_nint in range(bkg_dq.shape[0]):
-                accum_dq_arr = np.bitwise_or(bkg_dq[i_nint, :, :], accum_dq_arr)
-            avg_bkg.dq = np.bitwise_or(avg_bkg.dq, accum_dq_arr)
-
-    # Clip the background data
-    log.debug('clip with sigma={} maxiters={}'.format(sigma, maxiters))
-    mdata = sigma_clip(cdata, sigma=sigma, maxiters=maxiters, axis=0)
-
-    # Compute the mean of the non-clipped values
-    avg_bkg.data = mdata.mean(axis=0).data
-
-    # Mask the ERR values using the data mask
-    merr = np.ma.masked_array(cerr, mask=mdata.mask)
-
-    # Compute the combined ERR as the uncertainty in the mean
-    avg_bkg.err = (np.sqrt(merr.sum(axis=0)) / (num_bkg - merr.mask.sum(axis=0))).data
+            np.multiply(bkg_err, bkg_err, out=cerr[i])
+            return bkg_dq
+
+        # Sigma clip the bkg model's data and err along the integration
+        # axis (last) and accumulate the integ-averaged results for the
+        # file. The err cube is squared in place; it is not reused.
+        cdata[i] = _clipped_mean(bkg_data, sigma, maxiters, axis=-1)
+        np.multiply(bkg_err, bkg_err, out=bkg_err)
+        cerr[i] = _clipped_mean(bkg_err, sigma, maxiters, axis=-1)
+
+        # Collapse the DQ by doing a bitwise_OR over all integrations
+        return np.bitwise_or.reduce(bkg_dq, axis=-1)
+
+    with warnings.catch_warnings():
+        # NaN comparisons and all-NaN slices are expected while clipping
+        # and averaging
+        warnings.filterwarnings("ignore", category=RuntimeWarning)
+
+        # Each background is independent and fills only its own plane of
+        # the slabs, so accumulate them in a thread pool; the FITS reads
+        # and the numpy reductions release the GIL. DQ is OR-ed in the
+        # main thread, in list order.
+        max_workers = min(num_bkg, os.cpu_count() or 1) or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for bkg_dq in executor.map(accumulate_background, range(num_bkg), bkg_list):
+                if bkg_dq is not None:
+                    avg_bkg.dq = np.bitwise_or(avg_bkg.dq, bkg_dq)
+
+        # Clip the background data; clipped values are replaced by NaNs
+        log.debug('clip with sigma={} maxiters={}'.format(sigma, maxiters))
+        mdata = _sigma_clip_nan(cdata, sigma, maxiters, axis=0)
+
+        # Compute the mean of the non-clipped values, accumulating in
+        # float64 for precision; pixels with no contributing backgrounds
+        # average to zero, as before
+        avg_bkg.data = np.nan_to_num(np.nanmean(mdata, axis=0, dtype=np.float64), copy=False)
+
+    # Mask the ERR values using the data mask; cerr is not reused, so the
+    # clipped values can be NaNed out in place
+    bad = np.isnan(mdata)
+    cerr[bad] = np.nan
+
+    # Compute the combined ERR as the uncertainty in the mean; pixels with
+    # no contributing backgrounds get zero ERR, as before
+    with np.errstate(invalid='ignore', divide='ignore'):
+        err = (np.sqrt(np.nansum(cerr, axis=0, dtype=np.float64))
+               / (num_bkg - np.count_nonzero(bad, axis=0)))
+    avg_bkg.err = np.nan_to_num(err, copy=False)
 
     return avg_bkg
@@ -53,7 +53,8 @@ def subtract_wfss_bkg(
                     "Variance stopping criterion will have no effect for iterative "
                     "outlier rejection (will run until maxiter).")
         dispaxis = None
-    rescaler_kwargs["dispersion_axis"] = dispaxis
+    # copy so the caller's dict (and the shared default) is never mutated
+    rescaler_kwargs = {**rescaler_kwargs, "dispersion_axis": dispaxis}
 
     # get the source catalog for masking
     if hasattr(input_model.meta, "source_catalog"):
@@ -73,6 +74,28 @@ def subtract_wfss_bkg(
     else:
         bkg_mask = np.ones(input_model.data.shape, dtype=bool)
 
+    # A degenerate (empty or constant) reference image cannot constrain
+    # the iterative rescaling, so check for one before starting it. This
+    # comes after the sufficiency check so that exposures without usable
+    # background pixels are still skipped rather than marked complete.
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore",
+                                category=RuntimeWarning,
+                                message="All-NaN slice encountered")
+        ref_min = np.nanmin(bkg_ref.data)
+        ref_max = np.nanmax(bkg_ref.data)
+    if ref_min == ref_max == 0:
+        log.warning("Background reference image is identically zero; "
+                    "nothing to subtract.")
+        result = input_model.copy()
+        result.dq = np.bitwise_or(input_model.dq, bkg_ref.dq)
+        bkg_ref.close()
+        return result
+    if ref_min == ref_max:
+        log.info(f"Background reference image is constant ({ref_min}); "
+                 "skipping iterative outlier rejection.")
+        rescaler_kwargs["maxiter"] = 0
+
     # compute scaling factor for the reference background image
     log.info("Starting iterative outlier rejection for background subtraction.")
     rescaler = _ScalingFactorComputer(**rescaler_kwargs)
@@ -86,13 +109,16 @@ def subtract_wfss_bkg(
         bkg = bkg_ref.data.copy()
         factor, _ = rescaler(sci, bkg, var, mask=~bkg_mask)
 
-    # extract the derived factor and apply it to the unmasked, non-outlier-rejected data
-    subtract_this = factor * bkg_ref.data
+    # extract the derived factor and apply it to the unmasked,
+    # non-outlier-rejected data. The scaled background is built in
+    # result.data and subtracted in place, avoiding full-size temporaries.
     result = input_model.copy()
-    result.data = input_model.data - subtract_this
+    np.multiply(bkg_ref.data, factor, out=result.data)
+    mean_subtracted = np.nanmean(result.data)
+    np.subtract(input_model.data, result.data, out=result.data)
     result.dq = np.bitwise_or(input_model.dq, bkg_ref.dq)
 
-    log.info(f"Average of scaled background image = {np.nanmean(subtract_this):.3e}")
+    log.info(f"Average of scaled background image = {mean_subtracted:.3e}")
     log.info(f"Scaling factor = {factor:.5e}")
 
     bkg_ref.close()
@@ -160,14 +186,19 @@ class _ScalingFactorComputer:
             mask = np.zeros(sci.shape, dtype="bool")
         self._update_nans(sci, bkg, var, mask)
 
-        # iteratively reject more and more outliers
+        # iteratively reject more and more outliers.
+        # scratch buffers reused across iterations to avoid reallocating
+        # full-frame temporaries every pass
+        sci_sub = np.empty_like(sci)
+        outliers = np.empty(sci.shape, dtype=bool)
         i = 0
         last_rms_resid = np.inf
         while (i < self.maxiter):
 
             # compute the factor that minimizes the residuals
             factor = self.err_weighted_mean(sci, bkg, var)
-            sci_sub = sci-factor*bkg
+            np.multiply(bkg, -factor, out=sci_sub)
+            sci_sub += sci
 
             # Check fractional improvement stopping criterion before incrementing.
             # Note this never passes in iteration 0 because last_rms_resid is inf.
@@ -191,7 +222,9 @@ class _ScalingFactorComputer:
             # Updating the sci, var, and bkg nan values means that
             # they are ignored by nanpercentile in the next iteration
             limits = np.nanpercentile(sci_sub, (self.p, 100-self.p))
-            mask += np.logical_or(sci_sub < limits[0], sci_sub > limits[1])
+            np.less(sci_sub, limits[0], out=outliers)
+            np.logical_or(outliers, sci_sub > limits[1], out=outliers)
+            np.logical_or(mask, outliers, out=mask)
             self._update_nans(sci, bkg, var, mask)
 
         if i >= self.maxiter:
@@ -228,14 +261,12 @@ class _ScalingFactorComputer:
 def _sufficient_background_pixels(dq_array, bkg_mask, min_pixels=100):
     """Count number of good pixels for background use.
 
-    Check DQ flags of pixels selected for bkg use - XOR the DQ values with
-    the DO_NOT_USE flag to flip the DO_NOT_USE bit. Then count the number
-    of pixels that AND with the DO_NOT_USE flag, i.e. initially did not have
-    the DO_NOT_USE bit set.
+    Count the pixels in the background mask that do not have the
+    DO_NOT_USE DQ bit set. Doing this as a single fused expression
+    avoids gathering the masked DQ values into a temporary copy.
     """
-    return np.count_nonzero((dq_array[bkg_mask]
-                            ^ pixel['DO_NOT_USE'])
-                            & pixel['DO_NOT_USE']
+    return np.count_nonzero(((dq_array & pixel['DO_NOT_USE']) == 0)
+                            & bkg_mask
                             ) > min_pixels
 
 
@@ -262,23 +293,34 @@ def _mask_from_source_cat(input_model, wl_range_name, mmag_extract=None):
     """
 
     shape = input_model.data.shape
-    bkg_mask = np.ones(shape, dtype=bool)
+    ny, nx = shape[-2], shape[-1]
 
     reference_files = {"wavelengthrange": wl_range_name}
     grism_obj_list = create_grism_bbox(input_model, reference_files, mmag_extract)
 
+    # Rasterize all the source boxes in one pass rather than writing each
+    # box into the mask individually, which rereads and rewrites heavily
+    # overlapping regions on crowded fields. Mark the box corners in a 2D
+    # difference array and integrate it with two cumulative sums; pixels
+    # covered by at least one box end up with a positive count.
+    corners = np.zeros((ny + 1, nx + 1), dtype=np.int32)
     for obj in grism_obj_list:
         order_bounding = obj.order_bounding
         for order in order_bounding.keys():
             ((ymin, ymax), (xmin, xmax)) = order_bounding[order]
-            xmin = int(math.floor(xmin))
-            xmax = int(math.ceil(xmax)) + 1  # convert to slice limit
-            ymin = int(math.floor(ymin))
-            ymax = int(math.ceil(ymax)) + 1
-            xmin = max(xmin, 0)
-            xmax = min(xmax, shape[-1])
-            ymin = max(ymin, 0)
-            ymax = min(ymax, shape[-2])
-            bkg_mask[..., ymin:ymax, xmin:xmax] = False
+            xmin = max(int(math.floor(xmin)), 0)
+            xmax = min(int(math.ceil(xmax)) + 1, nx)  # convert to slice limit
+            ymin = max(int(math.floor(ymin)), 0)
+            ymax = min(int(math.ceil(ymax)) + 1, ny)
+            if xmin >= xmax or ymin >= ymax:
+                continue
+            corners[ymin, xmin] += 1
+            corners[ymin, xmax] -= 1
+            corners[ymax, xmin] -= 1
+            corners[ymax, xmax] += 1
+
+    coverage = corners.cumsum(axis=0).cumsum(axis=1)[:ny, :nx]
+    bkg_mask = np.empty(shape, dtype=bool)
+    bkg_mask[...] = (coverage == 0)
 
     return bkg_mask
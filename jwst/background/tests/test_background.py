@@ -1,11 +1,18 @@
 """
 Unit tests for background subtraction
 """
+import os
+
+import numpy as np
 import pytest
 from numpy.testing import assert_allclose
 
 from stdatamodels.jwst import datamodels
 from jwst.background import BackgroundStep
+from jwst.background.background_sub import (ImageSubsetArray,
+                                            _cached_subset_array,
+                                            _open_subset_array,
+                                            average_background)
 
 
 @pytest.fixture(scope='module')
@@ -222,3 +229,134 @@ def test_miri_subarray_partial_overlap(data_shape, background_shape):
 
     image.close()
     background.close()
+
+
+@pytest.mark.parametrize('ndim', [2, 3])
+def test_get_subset_array_full_overlap(ndim):
+    """The full-overlap fast path must return copies in the right layout."""
+    data_shape = (10, 10) if ndim == 2 else (2, 10, 10)
+    background_shape = (10, 10) if ndim == 2 else (3, 10, 10)
+    image = miri_rate_model(data_shape, value=10.0)
+    background = miri_rate_model(background_shape, value=1.0)
+    background.err = np.full(background_shape, 0.2, dtype=np.float32)
+    background.dq[..., 2, 3] = 1
+
+    subset = ImageSubsetArray(image)
+    bkg_subset = ImageSubsetArray(background)
+    bkg_data, bkg_err, bkg_dq = subset.get_subset_array(bkg_subset)
+
+    # 3D arrays come back with the integration axis last
+    if ndim == 3:
+        assert bkg_data.shape == (10, 10, background_shape[0])
+    else:
+        assert bkg_data.shape == data_shape
+    assert_allclose(bkg_data, 1.0)
+    assert_allclose(bkg_err, 0.2)
+    assert (bkg_dq[2, 3] == 1).all()
+
+    # the returned arrays must be copies, safe for in-place use
+    assert not np.shares_memory(bkg_data, bkg_subset.data)
+    assert not np.shares_memory(bkg_err, bkg_subset.err)
+    assert not np.shares_memory(bkg_dq, bkg_subset.dq)
+
+    image.close()
+    background.close()
+
+
+def test_average_background_combines_dq():
+    """DQ flags from all overlapping backgrounds are combined bitwise."""
+    image = miri_rate_model((20, 20), value=10.0)
+
+    bkg1 = miri_rate_model((10, 10), value=2.0)
+    bkg1.err = np.full((10, 10), 0.1, dtype=np.float32)
+    bkg1.dq[2, 3] = 1
+    bkg2 = miri_rate_model((20, 20), value=4.0)
+    bkg2.err = np.full((20, 20), 0.3, dtype=np.float32)
+    bkg2.dq[2, 3] = 4
+    bkg2.dq[5, 5] = 8
+    # a background with no overlap must contribute nothing
+    bkg3 = miri_rate_model((10, 10), value=7.0)
+    bkg3.meta.subarray.xstart = 31
+    bkg3.meta.subarray.ystart = 31
+    backgrounds = [bkg1, bkg2, bkg3]
+
+    avg = average_background(image, backgrounds, 3.0, None)
+
+    assert_allclose(avg.data[:10, :10], 3.0)
+    assert_allclose(avg.data[10:, :], 4.0)
+    assert_allclose(avg.data[:, 10:], 4.0)
+    assert_allclose(avg.err[:10, :10], np.sqrt(0.01 + 0.09) / 2.0, rtol=1e-6)
+    assert_allclose(avg.err[10:, :], 0.3, rtol=1e-6)
+    assert avg.dq[2, 3] == 5
+    assert avg.dq[5, 5] == 8
+
+    # results do not depend on the order the workers finish in
+    repeat = average_background(image, backgrounds, 3.0, None)
+    assert np.array_equal(avg.data, repeat.data)
+    assert np.array_equal(avg.err, repeat.err)
+    assert np.array_equal(avg.dq, repeat.dq)
+
+    image.close()
+    for background in backgrounds:
+        background.close()
+
+
+def test_average_background_mismatched_footprints():
+    """Average multiple backgrounds whose subarrays cover different regions.
+
+    Each pixel of the average must be the mean over only the backgrounds
+    that cover it; backgrounds with no coverage at a pixel must not
+    contribute zeros that drag the average low. Pixels covered by no
+    background at all end up with zero data and zero error.
+    """
+    image = miri_rate_model((2, 20, 20), value=10.0)
+    backgrounds = []
+    for value, size in ((1.0, 10), (2.0, 10), (3.0, 15)):
+        background = miri_rate_model((2, size, size), value=value)
+        background.err = np.full(background.data.shape, 0.2, dtype=np.float32)
+        backgrounds.append(background)
+
+    avg = average_background(image, backgrounds, 3.0, None)
+
+    # covered by all three backgrounds
+    assert_allclose(avg.data[:10, :10], 2.0)
+    assert_allclose(avg.err[:10, :10], 0.2 / np.sqrt(3.0), rtol=1e-6)
+    # covered by the 15x15 background only
+    assert_allclose(avg.data[:15, 10:15], 3.0)
+    assert_allclose(avg.data[10:15, :15], 3.0)
+    assert_allclose(avg.err[:15, 10:15], 0.2, rtol=1e-6)
+    assert_allclose(avg.err[10:15, :15], 0.2, rtol=1e-6)
+    # covered by nothing
+    assert_allclose(avg.data[15:, :], 0.0)
+    assert_allclose(avg.data[:, 15:], 0.0)
+    assert_allclose(avg.err[15:, :], 0.0)
+    assert_allclose(avg.err[:, 15:], 0.0)
+
+    image.close()
+    for background in backgrounds:
+        background.close()
+
+
+def test_subset_array_file_cache(tmp_path):
+    """Repeated opens hit the cache; rewriting the file invalidates it."""
+    filename = str(tmp_path / 'background.fits')
+    with miri_rate_model((10, 10), value=1.0) as image:
+        image.save(filename)
+
+    _cached_subset_array.cache_clear()
+    first = _open_subset_array(filename)
+    assert_allclose(first.data, 1.0)
+    assert _open_subset_array(filename) is first
+
+    # rewrite the same path with different contents; ensure the
+    # modification time changes even on coarse filesystem clocks
+    with miri_rate_model((10, 10), value=2.0) as image:
+        image.save(filename)
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    second = _open_subset_array(filename)
+    assert second is not first
+    assert_allclose(second.data, 2.0)
+
+    _cached_subset_array.cache_clear()
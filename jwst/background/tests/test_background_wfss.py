@@ -294,6 +294,103 @@ def test_sufficient_background_pixels():
     assert not _sufficient_background_pixels(model.dq, bkg_mask)
 
 
+@pytest.mark.parametrize("shape", [(16, 16), (2, 16, 16)])
+def test_mask_from_source_cat_rasterization(shape, monkeypatch):
+    """Check the rasterized source mask against a per-box reference."""
+    from types import SimpleNamespace
+    from jwst.background import background_sub_wfss
+
+    # boxes as ((ymin, ymax), (xmin, xmax)) in float pixel coordinates:
+    # two overlapping interior boxes, one straddling the top and right
+    # edges, and one entirely off the detector (which must mask nothing
+    # rather than wrap around)
+    boxes = [((2.2, 5.7), (3.1, 6.9)),
+             ((4.0, 9.0), (5.0, 12.0)),
+             ((-3.5, 2.0), (10.0, 20.0)),
+             ((-10.0, -4.0), (0.0, 5.0))]
+    grism_objects = [SimpleNamespace(order_bounding={1: box}) for box in boxes]
+    monkeypatch.setattr(background_sub_wfss, "create_grism_bbox",
+                        lambda *args: grism_objects)
+
+    model = datamodels.ImageModel(shape) if len(shape) == 2 \
+        else datamodels.CubeModel(shape)
+    bkg_mask = _mask_from_source_cat(model, None)
+    assert bkg_mask.shape == shape
+
+    # straightforward per-box reference, skipping the off-detector box
+    ny, nx = shape[-2], shape[-1]
+    expected = np.ones(shape, dtype=bool)
+    for (ymin, ymax), (xmin, xmax) in boxes[:-1]:
+        ylo = max(int(np.floor(ymin)), 0)
+        yhi = min(int(np.ceil(ymax)) + 1, ny)
+        xlo = max(int(np.floor(xmin)), 0)
+        xhi = min(int(np.ceil(xmax)) + 1, nx)
+        expected[..., ylo:yhi, xlo:xhi] = False
+
+    assert np.array_equal(bkg_mask, expected)
+    # the off-detector box must not have masked anything by itself
+    assert bkg_mask[..., 10:, :].all()
+
+
+def make_small_wfss_model(value, shape=(16, 16)):
+    """Make a minimal model for tests that do not need a real WCS."""
+    image = datamodels.ImageModel(shape)
+    image.data = np.full(shape, value, dtype=np.float32)
+    image.err = np.full(shape, 0.1, dtype=np.float32)
+    image.dq = np.zeros(shape, dtype=np.uint32)
+    image.meta.source_catalog = "mock_cat.ecsv"
+    return image
+
+
+def test_zero_reference_background(tmp_path, monkeypatch):
+    """A zero reference image should return the input unchanged except DQ."""
+    from jwst.background import background_sub_wfss
+
+    monkeypatch.setattr(background_sub_wfss, "_mask_from_source_cat",
+                        lambda *args: np.ones((16, 16), dtype=bool))
+
+    bkg_image = make_small_wfss_model(0.0)
+    bkg_image.dq[3, 5] = pixel['DO_NOT_USE']
+    bkg_fname = str(tmp_path / "zero_bkg.fits")
+    bkg_image.save(bkg_fname)
+
+    data = make_small_wfss_model(3.0)
+    data.dq[0, 0] = pixel['SATURATED']
+    result = subtract_wfss_bkg(data, bkg_fname, None)
+
+    assert np.array_equal(result.data, data.data)
+    assert result.dq[3, 5] == pixel['DO_NOT_USE']
+    assert result.dq[0, 0] == pixel['SATURATED']
+
+    # the sufficiency check still comes first, so an exposure without
+    # usable background pixels is skipped rather than marked complete
+    monkeypatch.setattr(background_sub_wfss, "_sufficient_background_pixels",
+                        lambda *args: False)
+    assert subtract_wfss_bkg(data, bkg_fname, None) is None
+
+
+def test_constant_reference_background(tmp_path, monkeypatch):
+    """A constant reference image skips iteration but is still subtracted."""
+    from jwst.background import background_sub_wfss
+
+    monkeypatch.setattr(background_sub_wfss, "_mask_from_source_cat",
+                        lambda *args: np.ones((16, 16), dtype=bool))
+
+    bkg_image = make_small_wfss_model(2.0)
+    bkg_fname = str(tmp_path / "const_bkg.fits")
+    bkg_image.save(bkg_fname)
+
+    data = make_small_wfss_model(3.0)
+    rescaler_kwargs = {"maxiter": 5}
+    result = subtract_wfss_bkg(data, bkg_fname, None,
+                               rescaler_kwargs=rescaler_kwargs)
+
+    # err-weighted factor is 1.5 here, so the background subtracts exactly
+    assert np.allclose(result.data, 0.0)
+    # the caller's kwargs must not pick up the maxiter override
+    assert rescaler_kwargs == {"maxiter": 5}
+
+
 def test_weighted_mean(make_wfss_datamodel, bkg_file):
 
     sci = make_wfss_datamodel.data
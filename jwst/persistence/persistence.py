@@ -44,6 +44,17 @@ def no_NaN(input_model, fill_value,
         attribute replaced with `fill_value`.
     """
 
+    if zap_nan and not zap_zero:
+        # Common case:  replace NaNs in a single in-place pass, with no
+        # boolean mask to build and scatter through.  Infinities are
+        # deliberately left alone.
+        if not np.isnan(input_model.data).any():
+            return input_model
+        temp = input_model.copy()
+        np.nan_to_num(temp.data, copy=False, nan=fill_value,
+                      posinf=np.inf, neginf=-np.inf)
+        return temp
+
     mask = None
 
     if zap_nan:
@@ -53,9 +64,9 @@ def no_NaN(input_model, fill_value,
         if mask is None:
             mask = (input_model.data == 0.)
         else:
-            mask = np.logical_or(mask, (input_model.data == 0.))
+            np.logical_or(mask, (input_model.data == 0.), out=mask)
 
-    if mask is None or mask.sum(dtype=np.intp) == 0:
+    if mask is None or not mask.any():
         return input_model
     else:
         temp = input_model.copy()